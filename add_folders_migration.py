@@ -10,6 +10,7 @@ def add_folders_feature():
     
     conn = pymysql.connect(
         host=os.getenv('DB_HOST'),
+        port=int(os.getenv('DB_PORT', 3306)),
         user=os.getenv('DB_USER'),
         password=os.getenv('DB_PASSWORD'),
         db=os.getenv('DB_NAME'),
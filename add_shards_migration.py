@@ -0,0 +1,59 @@
+import pymysql
+import os
+from dotenv import load_dotenv
+from sharding import DIRECTORY_NAME
+
+# Load environment variables
+load_dotenv()
+
+def add_shards_feature():
+    """Add the user_shards directory table and assign existing users"""
+    
+    conn = pymysql.connect(
+        host=os.getenv('DB_HOST'),
+        port=int(os.getenv('DB_PORT', 3306)),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        db=os.getenv('DB_NAME'),
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor
+    )
+    
+    try:
+        with conn.cursor() as cur:
+            # Create directory table
+            print("Creating user_shards table...")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS user_shards (
+                    user_id INT PRIMARY KEY,
+                    shard VARCHAR(64) NOT NULL,
+                    status ENUM('active', 'migrating') NOT NULL DEFAULT 'active',
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                    INDEX idx_shard (shard)
+                )
+            """)
+            print("✓ user_shards table created")
+            
+            # Existing vaults are still in this database, the directory shard
+            print(f"Assigning existing users to shard '{DIRECTORY_NAME}'...")
+            result = cur.execute("""
+                INSERT IGNORE INTO user_shards (user_id, shard)
+                SELECT id, %s FROM users
+            """, (DIRECTORY_NAME,))
+            print(f"✓ {result} users assigned")
+            
+            conn.commit()
+            print("\n✅ Sharding directory added successfully!")
+            print("\nNote: list only the other servers in DB_SHARDS, not this database.")
+            print("Use move_user_shard.py to move users onto other shards.")
+            
+    except Exception as e:
+        print(f"\n❌ Error during migration: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    print("Adding sharding directory to LockBox...")
+    add_shards_feature()
@@ -1,5 +1,5 @@
 import os
-from flask import Flask, render_template, redirect, url_for, request, flash
+from flask import Flask, render_template, redirect, url_for, request, flash, session
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import pymysql
 from cryptography.fernet import Fernet
@@ -7,6 +7,8 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 import re
 from datetime import timedelta
+from sharding import get_directory_connection, get_shard_connection, assign_user, mirror_user, ShardMigratingError
+from session_store import create_store, ServerSessionInterface
 
 # Load environment variables
 load_dotenv()
@@ -15,25 +17,41 @@ app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY')
 app.permanent_session_lifetime = timedelta(minutes=30)  # Session timeout
 
+# Server-side sessions: memory (single process) or redis (shared between workers)
+session_store = create_store(os.getenv('SESSION_STORE'), os.getenv('SESSION_REDIS_URL'))
+app.session_interface = ServerSessionInterface(session_store)
+
 # Encryption setup
 f = Fernet(os.getenv('ENCRYPTION_KEY').encode())
 
 # Database helper
-def get_db_connection():
-    return pymysql.connect(
-        host=os.getenv('DB_HOST'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        db=os.getenv('DB_NAME'),
-        charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
-    )
+def get_db_connection(user_id=None):
+    """Connect to the user's shard, or to the directory (users table) if no user is given"""
+    if user_id is None:
+        return get_directory_connection()
+    return get_shard_connection(user_id)
+
+@app.errorhandler(ShardMigratingError)
+def shard_migrating(e):
+    return 'Your vault is being moved to a new server. Please try again in a moment.', 503
 
 # Flask-Login setup
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 
+# Logins live only in the server-side session so they can be revoked. Older
+# versions set 365-day "remember_token" cookies; use a name nothing sets so
+# Flask-Login ignores those, and delete them when a browser sends one.
+LEGACY_REMEMBER_COOKIE = 'remember_token'
+app.config['REMEMBER_COOKIE_NAME'] = 'remember_token_disabled'
+
+@app.after_request
+def clear_legacy_remember_cookie(response):
+    if LEGACY_REMEMBER_COOKIE in request.cookies:
+        response.delete_cookie(LEGACY_REMEMBER_COOKIE)
+    return response
+
 class User(UserMixin):
     def __init__(self, id, username, email, pw_hash):
         self.id = id
@@ -41,8 +59,17 @@ class User(UserMixin):
         self.email = email
         self.password_hash = pw_hash
 
+def user_snapshot(user):
+    """What gets cached in the session so requests don't hit the database"""
+    return {'id': user.id, 'username': user.username, 'email': user.email}
+
 @login_manager.user_loader
 def load_user(user_id):
+    # Fast path: the user was cached in the session at login
+    cached = session.get('user')
+    if cached and str(cached['id']) == str(user_id):
+        return User(cached['id'], cached['username'], cached['email'], None)
+    
     conn = get_db_connection()
     with conn.cursor() as cur:
         # First check if email column exists
@@ -62,7 +89,11 @@ def load_user(user_id):
         
         row = cur.fetchone()
     conn.close()
-    return User(row['id'], row['username'], row.get('email', ''), row['password_hash']) if row else None
+    if not row:
+        return None
+    user = User(row['id'], row['username'], row.get('email', ''), row['password_hash'])
+    session['user'] = user_snapshot(user)
+    return user
 
 # Password strength validator
 def is_strong_password(password):
@@ -140,7 +171,20 @@ def register():
                     cur.execute("INSERT INTO users (username, password_hash) VALUES (%s,%s)", 
                                (uname, pw_hash))
                 
+                # Place the new user's vault on a shard
+                user_id = cur.lastrowid
+                shard = assign_user(cur, user_id)
                 conn.commit()
+                
+                # The user must exist on their shard before entries can be added
+                try:
+                    mirror_user(shard, user_id, uname, email)
+                except pymysql.MySQLError:
+                    cur.execute("DELETE FROM users WHERE id=%s", (user_id,))
+                    conn.commit()
+                    flash('Registration failed, please try again.', 'error')
+                    return render_template('register.html')
+                
                 flash('Registration successful! Please log in.', 'success')
                 return redirect(url_for('login'))
         except pymysql.err.IntegrityError:
@@ -199,8 +243,13 @@ def login():
         conn.close()
         
         if user and check_password_hash(user['password_hash'], pwd):
-            login_user(User(user['id'], user['username'], user.get('email', ''), user['password_hash']), 
-                      remember=True)
+            # New session id on login; the server-side session slides with
+            # permanent_session_lifetime, so no long-lived remember cookie
+            session.regenerate()
+            session.permanent = True
+            logged_in = User(user['id'], user['username'], user.get('email', ''), user['password_hash'])
+            login_user(logged_in)
+            session['user'] = user_snapshot(logged_in)
             flash(f'Welcome back, {user["username"]}!', 'success')
             return redirect(url_for('dashboard'))
         flash('Invalid username/email or password.', 'error')
@@ -209,7 +258,7 @@ def login():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    conn = get_db_connection()
+    conn = get_db_connection(current_user.id)
     
     # Get selected folder from query parameter
     selected_folder_id = request.args.get('folder', type=int)
@@ -327,7 +376,7 @@ def dashboard():
 @app.route('/add', methods=['GET','POST'])
 @login_required
 def add_entry():
-    conn = get_db_connection()
+    conn = get_db_connection(current_user.id)
     
     # Get folders for dropdown
     folders = []
@@ -388,7 +437,7 @@ def add_entry():
 @app.route('/edit/<int:id>', methods=['GET','POST'])
 @login_required
 def edit_entry(id):
-    conn = get_db_connection()
+    conn = get_db_connection(current_user.id)
     with conn.cursor() as cur:
         cur.execute("SELECT * FROM entries WHERE id=%s AND user_id=%s", (id, current_user.id))
         entry = cur.fetchone()
@@ -431,7 +480,7 @@ def edit_entry(id):
 @app.route('/delete/<int:id>', methods=['POST'])
 @login_required
 def delete_entry(id):
-    conn = get_db_connection()
+    conn = get_db_connection(current_user.id)
     with conn.cursor() as cur:
         result = cur.execute("DELETE FROM entries WHERE id=%s AND user_id=%s", (id, current_user.id))
         conn.commit()
@@ -448,9 +497,35 @@ def delete_entry(id):
 @login_required
 def logout():
     logout_user()
+    session.pop('user', None)
+    session.regenerate()
     flash('You have been logged out.', 'info')
     return redirect(url_for('login'))
 
+# Active sessions endpoint
+@app.route('/sessions')
+@login_required
+def list_sessions():
+    sessions = session_store.sessions_for_user(str(current_user.id))
+    return {'sessions': [
+        {
+            'created': record['created'],
+            'last_seen': record['last_seen'],
+            'current': sid == session.sid
+        }
+        for sid, record in sorted(sessions.items(), key=lambda item: item[1]['last_seen'], reverse=True)
+    ]}
+
+@app.route('/logout-all', methods=['POST'])
+@login_required
+def logout_all():
+    count = session_store.delete_user(str(current_user.id))
+    logout_user()
+    session.pop('user', None)
+    session.regenerate()
+    flash(f'Logged out of {count} session(s).', 'info')
+    return redirect(url_for('login'))
+
 # Password generator endpoint
 @app.route('/generate-password')
 @login_required
@@ -480,7 +555,7 @@ def create_folder():
     colors = ['#ef4444', '#f59e0b', '#10b981', '#3b82f6', '#8b5cf6', '#ec4899', '#14b8a6', '#f97316']
     color = random.choice(colors)
     
-    conn = get_db_connection()
+    conn = get_db_connection(current_user.id)
     try:
         with conn.cursor() as cur:
             cur.execute("""
@@ -0,0 +1,25 @@
+import sys
+from sharding import SHARDS_BY_NAME, move_user
+
+def main():
+    """Move one user's vault to another shard: python move_user_shard.py <user_id> <shard>"""
+    
+    if len(sys.argv) != 3:
+        print("Usage: python move_user_shard.py <user_id> <shard>")
+        print(f"Shards: {', '.join(SHARDS_BY_NAME)}")
+        sys.exit(1)
+    
+    user_id, shard_name = int(sys.argv[1]), sys.argv[2]
+    if shard_name not in SHARDS_BY_NAME:
+        print(f"❌ Unknown shard '{shard_name}'. Shards: {', '.join(SHARDS_BY_NAME)}")
+        sys.exit(1)
+    
+    try:
+        shard = move_user(user_id, shard_name)
+        print(f"✅ User {user_id} is now on shard '{shard.name}'")
+    except Exception as e:
+        print(f"\n❌ Error moving user {user_id}: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
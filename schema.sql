@@ -22,4 +22,13 @@ CREATE TABLE entries (
   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
   INDEX idx_user_created (user_id, created_at)
-);
\ No newline at end of file
+);
+
+CREATE TABLE user_shards (
+  user_id INT PRIMARY KEY,
+  shard VARCHAR(64) NOT NULL,
+  status ENUM('active', 'migrating') NOT NULL DEFAULT 'active',
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+  INDEX idx_shard (shard)
+);
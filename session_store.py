@@ -0,0 +1,357 @@
+import secrets
+import threading
+import time
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class SessionStore:
+    """Where session records live. A record is a dict with the serialized
+    session data, the logged-in user id, and created/last_seen timestamps.
+    """
+
+    def get(self, sid):
+        raise NotImplementedError
+
+    def save(self, sid, data, user_id, ttl, new=False):
+        """Write a session. Only new sessions create a record; an existing
+        sid is updated only if it is still there, so a revoked session can't
+        be brought back by a request that was already in flight. Returns
+        whether the session was written.
+        """
+        raise NotImplementedError
+
+    def touch(self, sid, ttl):
+        """Push back expiry (and last_seen) without rewriting the data.
+        Returns whether the session still exists.
+        """
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def sessions_for_user(self, user_id):
+        """Return {sid: record} for the user's live sessions"""
+        raise NotImplementedError
+
+    def delete_user(self, user_id):
+        """Revoke every session of a user, returns how many were removed"""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process store, fine for a single `flask run` process.
+
+    Holds at most max_records sessions. When full, the anonymous sessions
+    closest to expiry are evicted first; logged-in sessions are never
+    evicted, since each one needs a successful login.
+    """
+
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, max_records=10000):
+        self.max_records = max_records
+        self.records = {}   # sid -> (record, expires_at)
+        self.by_user = {}   # user_id -> set of sids
+        self.lock = threading.Lock()
+        self.last_sweep = time.time()
+
+    def _live(self, sid, now):
+        item = self.records.get(sid)
+        if item and item[1] <= now:
+            self._drop(sid)
+            return None
+        return item
+
+    def _drop(self, sid):
+        record, _ = self.records.pop(sid, (None, None))
+        if record and record['user_id'] is not None:
+            sids = self.by_user.get(record['user_id'])
+            if sids:
+                sids.discard(sid)
+                if not sids:
+                    del self.by_user[record['user_id']]
+
+    def _sweep(self, now, force=False):
+        if not force and now - self.last_sweep < self.SWEEP_INTERVAL:
+            return
+        self.last_sweep = now
+        for sid in [s for s, (_, exp) in self.records.items() if exp <= now]:
+            self._drop(sid)
+
+    def _make_room(self, now):
+        self._sweep(now, force=True)
+        if len(self.records) < self.max_records:
+            return
+        anonymous = sorted((exp, sid) for sid, (record, exp) in self.records.items()
+                           if record['user_id'] is None)
+        # Evict a batch so a full store doesn't rescan on every new session
+        for _, sid in anonymous[:max(1, self.max_records // 10)]:
+            self._drop(sid)
+
+    def get(self, sid):
+        with self.lock:
+            item = self._live(sid, time.time())
+            return dict(item[0]) if item else None
+
+    def save(self, sid, data, user_id, ttl, new=False):
+        now = time.time()
+        with self.lock:
+            self._sweep(now)
+            item = self._live(sid, now)
+            if not item and not new:
+                return False
+            if not item and len(self.records) >= self.max_records:
+                self._make_room(now)
+            created = item[0]['created'] if item else now
+            if item and item[0]['user_id'] != user_id:
+                self._drop(sid)
+            record = {'data': data, 'user_id': user_id, 'created': created, 'last_seen': now}
+            self.records[sid] = (record, now + ttl)
+            if user_id is not None:
+                self.by_user.setdefault(user_id, set()).add(sid)
+            return True
+
+    def touch(self, sid, ttl):
+        now = time.time()
+        with self.lock:
+            item = self._live(sid, now)
+            if not item:
+                return False
+            item[0]['last_seen'] = now
+            self.records[sid] = (item[0], now + ttl)
+            return True
+
+    def delete(self, sid):
+        with self.lock:
+            self._drop(sid)
+
+    def sessions_for_user(self, user_id):
+        now = time.time()
+        with self.lock:
+            sids = list(self.by_user.get(user_id, ()))
+            return {sid: dict(item[0]) for sid in sids if (item := self._live(sid, now))}
+
+    def delete_user(self, user_id):
+        with self.lock:
+            sids = list(self.by_user.get(user_id, ()))
+            for sid in sids:
+                self._drop(sid)
+            return len(sids)
+
+
+class RedisSessionStore(SessionStore):
+    """Shared store so every worker/server sees the same sessions.
+
+    Each session is a hash at session:<sid> and each user has a set of their
+    sids at user_sessions:<user_id>; both expire with the session lifetime.
+    """
+
+    # Touch in one step: a session revoked mid-touch must not come back as a
+    # hash with only last_seen, and the user's set slides along with it.
+    TOUCH_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            return 0
+        end
+        redis.call('HSET', KEYS[1], 'last_seen', ARGV[2])
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+        local user_id = redis.call('HGET', KEYS[1], 'user_id')
+        if user_id and user_id ~= '' then
+            local user_key = ARGV[3] .. user_id
+            redis.call('SADD', user_key, ARGV[4])
+            redis.call('EXPIRE', user_key, ARGV[1])
+        end
+        return 1
+    """
+
+    # Save in one step for the same reason, and only create the hash for a
+    # new session. ARGV: data, user_id, now, ttl, new, user key prefix, sid
+    SAVE_SCRIPT = """
+        if ARGV[5] ~= '1' and redis.call('EXISTS', KEYS[1]) == 0 then
+            return 0
+        end
+        local old_user = redis.call('HGET', KEYS[1], 'user_id')
+        if old_user and old_user ~= '' and old_user ~= ARGV[2] then
+            redis.call('SREM', ARGV[6] .. old_user, ARGV[7])
+        end
+        redis.call('HSETNX', KEYS[1], 'created', ARGV[3])
+        redis.call('HSET', KEYS[1], 'data', ARGV[1], 'user_id', ARGV[2], 'last_seen', ARGV[3])
+        redis.call('EXPIRE', KEYS[1], ARGV[4])
+        if ARGV[2] ~= '' then
+            local user_key = ARGV[6] .. ARGV[2]
+            redis.call('SADD', user_key, ARGV[7])
+            redis.call('EXPIRE', user_key, ARGV[4])
+        end
+        return 1
+    """
+
+    def __init__(self, url, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("SESSION_STORE=redis needs the redis package: pip install redis")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.touch_script = self.redis.register_script(self.TOUCH_SCRIPT)
+        self.save_script = self.redis.register_script(self.SAVE_SCRIPT)
+
+    @staticmethod
+    def _key(sid):
+        return f"session:{sid}"
+
+    @staticmethod
+    def _user_key(user_id):
+        return f"user_sessions:{user_id}"
+
+    @staticmethod
+    def _record(raw):
+        if not raw or 'data' not in raw:
+            return None
+        return {
+            'data': raw['data'],
+            'user_id': raw.get('user_id') or None,
+            'created': float(raw['created']),
+            'last_seen': float(raw['last_seen']),
+        }
+
+    def get(self, sid):
+        return self._record(self.redis.hgetall(self._key(sid)))
+
+    def save(self, sid, data, user_id, ttl, new=False):
+        return bool(self.save_script(
+            keys=[self._key(sid)],
+            args=[data, user_id or '', time.time(), ttl, '1' if new else '0', self._user_key(''), sid]
+        ))
+
+    def touch(self, sid, ttl):
+        return bool(self.touch_script(keys=[self._key(sid)], args=[ttl, time.time(), self._user_key(''), sid]))
+
+    def delete(self, sid):
+        self.redis.delete(self._key(sid))
+
+    def sessions_for_user(self, user_id):
+        sessions = {}
+        stale = []
+        for sid in self.redis.smembers(self._user_key(user_id)):
+            record = self.get(sid)
+            if record and record['user_id'] == user_id:
+                sessions[sid] = record
+            else:
+                stale.append(sid)
+        if stale:
+            self.redis.srem(self._user_key(user_id), *stale)
+        return sessions
+
+    def delete_user(self, user_id):
+        sids = self.sessions_for_user(user_id)
+        pipe = self.redis.pipeline()
+        for sid in sids:
+            pipe.delete(self._key(sid))
+        pipe.delete(self._user_key(user_id))
+        pipe.execute()
+        return len(sids)
+
+
+def create_store(kind, redis_url=None):
+    if kind == 'redis':
+        return RedisSessionStore(redis_url or 'redis://localhost:6379/0')
+    if kind in (None, '', 'memory'):
+        return MemorySessionStore()
+    raise ValueError(f"Unknown SESSION_STORE '{kind}', expected 'memory' or 'redis'")
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid or new_sid()
+        self.new = new
+        self.old_sid = None
+        self.modified = False
+
+    def regenerate(self):
+        """Move the session to a fresh id (call on login/logout) and drop the old record"""
+        if not self.new and self.old_sid is None:
+            self.old_sid = self.sid
+        self.sid = new_sid()
+        self.new = True
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps session data in a SessionStore; the cookie only carries the id.
+
+    Expiry slides: every request pushes the record's lifetime back to
+    permanent_session_lifetime, and unmodified sessions are only touched.
+    Anonymous sessions (typically just a flash message for the next page)
+    only live for ANONYMOUS_TTL seconds, so crawlers and failed logins
+    don't pile up records.
+    """
+
+    serializer = TaggedJSONSerializer()
+    ANONYMOUS_TTL = 300
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            record = self.store.get(sid)
+            if record:
+                return ServerSession(self.serializer.loads(record['data']), sid=sid)
+        return ServerSession(new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.old_sid:
+            self.store.delete(session.old_sid)
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+            if not session.new or session.old_sid:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        user_id = session.get('_user_id')
+        ttl = int(app.permanent_session_lifetime.total_seconds())
+        if user_id is None:
+            ttl = min(ttl, self.ANONYMOUS_TTL)
+        if session.new or session.modified:
+            saved = self.store.save(session.sid, self.serializer.dumps(dict(session)),
+                                    str(user_id) if user_id is not None else None, ttl,
+                                    new=session.new)
+        else:
+            saved = self.store.touch(session.sid, ttl)
+
+        if not saved:
+            # Revoked while this request was running
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Permanent cookies get their expiry pushed back along with the record
+        if session.new or session.permanent:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
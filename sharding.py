@@ -0,0 +1,368 @@
+import os
+import bisect
+import hashlib
+import time
+import pymysql
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Points each shard gets on the hash ring
+VIRTUAL_NODES = 100
+
+# How long a process trusts its cached user -> shard lookup. move_user waits
+# longer than this after marking a user as migrating, so no worker can still
+# be writing to the old shard when the copy starts.
+SHARD_CACHE_TTL = 5
+
+
+class Shard:
+    def __init__(self, name, host, port, db):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.db = db
+
+    def __repr__(self):
+        return f"Shard({self.name}={self.host}:{self.port}/{self.db})"
+
+
+class ShardMigratingError(Exception):
+    """Raised when a user's vault is being moved between shards"""
+
+
+def parse_shards(spec):
+    """Parse DB_SHARDS ("name=host:port/db,...") into a list of extra shards"""
+    shards = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, location = item.partition('=')
+        if not location:
+            raise ValueError(f"Invalid shard '{item}', expected name=host:port/db")
+        if name.strip() == DIRECTORY_NAME:
+            raise ValueError(f"'{DIRECTORY_NAME}' is reserved for the DB_* database, don't list it in DB_SHARDS")
+        address, _, db = location.partition('/')
+        host, _, port = address.partition(':')
+        shards.append(Shard(name.strip(), host or 'localhost', int(port or 3306),
+                            db or os.getenv('DB_NAME')))
+    return shards
+
+
+# The directory database is the original DB_* database. It keeps the users
+# table (so usernames/emails stay unique and ids stay global) and the
+# user_shards table that says where each user's folders and entries live.
+# It is always a shard itself, under a fixed name, so user_shards rows stay
+# valid however DB_SHARDS changes.
+DIRECTORY_NAME = 'directory'
+DIRECTORY = Shard(DIRECTORY_NAME, os.getenv('DB_HOST'), int(os.getenv('DB_PORT', 3306)),
+                  os.getenv('DB_NAME'))
+
+# DB_SHARDS lists the extra shards; without it everything lives in the
+# directory database, as before
+SHARDS = [DIRECTORY] + parse_shards(os.getenv('DB_SHARDS', ''))
+SHARDS_BY_NAME = {s.name: s for s in SHARDS}
+
+
+def connect(shard):
+    return pymysql.connect(
+        host=shard.host,
+        port=shard.port,
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        db=shard.db,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor
+    )
+
+
+def get_directory_connection():
+    return connect(DIRECTORY)
+
+
+def is_directory(shard):
+    return shard.name == DIRECTORY_NAME
+
+
+def _identity(cur):
+    """Which server and database a connection really points at"""
+    cur.execute("SELECT @@hostname as host, @@port as port, @@datadir as datadir, DATABASE() as db")
+    return tuple(cur.fetchone().values())
+
+
+directory_identity = None
+
+
+def is_directory_connection(cur):
+    """True if cur is connected to the directory database, however it was addressed"""
+    global directory_identity
+    if directory_identity is None:
+        conn = get_directory_connection()
+        try:
+            with conn.cursor() as dcur:
+                directory_identity = _identity(dcur)
+        finally:
+            conn.close()
+    return _identity(cur) == directory_identity
+
+
+class HashRing:
+    """Consistent-hash ring used to place newly registered users"""
+
+    def __init__(self, names, vnodes=VIRTUAL_NODES):
+        self.points = []
+        for name in names:
+            for i in range(vnodes):
+                self.points.append((self._hash(f"{name}#{i}"), name))
+        self.points.sort()
+        self.keys = [p[0] for p in self.points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def lookup(self, key):
+        i = bisect.bisect(self.keys, self._hash(key)) % len(self.points)
+        return self.points[i][1]
+
+
+ring = HashRing([s.name for s in SHARDS])
+
+
+def place_user(user_id):
+    """Pick the shard a new user should live on"""
+    return SHARDS_BY_NAME[ring.lookup(str(user_id))]
+
+
+def lookup_shard(cur, user_id):
+    """Return (shard, status) for a user from the directory.
+
+    Users without a directory row (or databases that predate user_shards)
+    live in the directory database.
+    """
+    try:
+        cur.execute("SELECT shard, status FROM user_shards WHERE user_id=%s", (user_id,))
+        row = cur.fetchone()
+    except pymysql.err.ProgrammingError:
+        row = None
+    if not row:
+        return DIRECTORY, 'active'
+    if row['shard'] not in SHARDS_BY_NAME:
+        raise LookupError(f"User {user_id} is on unknown shard '{row['shard']}'")
+    return SHARDS_BY_NAME[row['shard']], row['status']
+
+
+# user_id -> (shard, expires_at), only for users whose status is active
+shard_cache = {}
+
+
+def shard_for_user(user_id):
+    """Return the user's shard, asking the directory at most every SHARD_CACHE_TTL seconds"""
+    now = time.time()
+    cached = shard_cache.get(user_id)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    conn = get_directory_connection()
+    try:
+        with conn.cursor() as cur:
+            shard, status = lookup_shard(cur, user_id)
+    finally:
+        conn.close()
+    if status == 'migrating':
+        shard_cache.pop(user_id, None)
+        raise ShardMigratingError(f"User {user_id} is being moved off shard '{shard.name}'")
+    shard_cache[user_id] = (shard, now + SHARD_CACHE_TTL)
+    return shard
+
+
+def get_shard_connection(user_id):
+    """Connect to the shard holding the user's folders and entries"""
+    return connect(shard_for_user(user_id))
+
+
+def mirror_user(shard, user_id, username, email):
+    """Create the user's row on a shard so entries/folders foreign keys hold.
+
+    The password hash is only kept in the directory. A row already there
+    with the same id is reused; any other unique-key clash raises
+    IntegrityError.
+    """
+    if is_directory(shard):
+        return
+    conn = connect(shard)
+    try:
+        with conn.cursor() as cur:
+            if is_directory_connection(cur):
+                raise RuntimeError(f"Shard '{shard.name}' is the directory database, remove it from DB_SHARDS")
+            cur.execute("SELECT id FROM users WHERE id=%s", (user_id,))
+            if cur.fetchone():
+                return
+            cur.execute(
+                "INSERT INTO users (id, username, email, password_hash) VALUES (%s,%s,%s,'')",
+                (user_id, username, email)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def assign_user(cur, user_id):
+    """Place a newly registered user on a shard.
+
+    Runs inside the registration transaction on the directory connection.
+    The caller commits, then calls mirror_user for the returned shard.
+    """
+    shard = place_user(user_id)
+    try:
+        cur.execute("INSERT INTO user_shards (user_id, shard) VALUES (%s,%s)", (user_id, shard.name))
+    except pymysql.err.ProgrammingError:
+        # No user_shards table yet, so the user stays in the directory
+        shard = DIRECTORY
+    return shard
+
+
+def _has_table(cur, table):
+    cur.execute("""
+        SELECT COUNT(*) as count
+        FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = %s
+    """, (table,))
+    return cur.fetchone()['count'] > 0
+
+
+def _insert_row(cur, table, row):
+    cols = [c for c in row if c != 'id']
+    cur.execute(
+        f"INSERT INTO {table} ({','.join(f'`{c}`' for c in cols)}) VALUES ({','.join(['%s'] * len(cols))})",
+        [row[c] for c in cols]
+    )
+    return cur.lastrowid
+
+
+def _delete_user_data(conn, shard, user_id, drop_user=False):
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM entries WHERE user_id=%s", (user_id,))
+        if _has_table(cur, 'folders'):
+            cur.execute("DELETE FROM folders WHERE user_id=%s", (user_id,))
+        # The directory's users row is the account itself, never drop it
+        if drop_user and not is_directory(shard) and not is_directory_connection(cur):
+            cur.execute("DELETE FROM users WHERE id=%s", (user_id,))
+    conn.commit()
+
+
+def _set_shard(user_id, shard, status):
+    conn = get_directory_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO user_shards (user_id, shard, status) VALUES (%s,%s,%s)
+                ON DUPLICATE KEY UPDATE shard=VALUES(shard), status=VALUES(status)
+            """, (user_id, shard.name, status))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _mark_migrating(user_id, source):
+    """Flag the user as migrating; only one concurrent move can win this"""
+    conn = get_directory_connection()
+    try:
+        with conn.cursor() as cur:
+            # Users that predate user_shards get their row first
+            cur.execute("INSERT IGNORE INTO user_shards (user_id, shard) VALUES (%s,%s)",
+                        (user_id, source.name))
+            updated = cur.execute("""
+                UPDATE user_shards SET status='migrating'
+                WHERE user_id=%s AND shard=%s AND status='active'
+            """, (user_id, source.name))
+        conn.commit()
+    finally:
+        conn.close()
+    if updated != 1:
+        raise ShardMigratingError(f"User {user_id} is already being moved")
+
+
+def move_user(user_id, target_name, drain_seconds=SHARD_CACHE_TTL + 2):
+    """Move a user's folders and entries to another shard while the app runs.
+
+    The user is marked as migrating first, so new requests for them get a
+    "try again" response instead of writing to the old shard. After a drain
+    that outlasts every worker's shard cache and in-flight requests, the
+    data is copied, checked, and the directory is flipped to the new shard
+    before the old copy is removed.
+    Entry and folder ids change because the target assigns its own.
+    """
+    target = SHARDS_BY_NAME[target_name]
+
+    conn = get_directory_connection()
+    try:
+        with conn.cursor() as cur:
+            source, status = lookup_shard(cur, user_id)
+            cur.execute("SELECT * FROM users WHERE id=%s", (user_id,))
+            user = cur.fetchone()
+    finally:
+        conn.close()
+
+    if not user:
+        raise LookupError(f"User {user_id} does not exist")
+    if source.name == target.name:
+        return source
+    if status == 'migrating':
+        raise ShardMigratingError(f"User {user_id} is already being moved")
+
+    _mark_migrating(user_id, source)
+    shard_cache.pop(user_id, None)
+
+    # From here on the user must end up active again, even on Ctrl-C
+    moved = False
+    src = dst = None
+    try:
+        time.sleep(drain_seconds)
+        src = connect(source)
+        mirror_user(target, user_id, user['username'], user.get('email', ''))
+        dst = connect(target)
+        # Clear anything left behind by an earlier, aborted move
+        _delete_user_data(dst, target, user_id)
+
+        try:
+            with src.cursor() as scur, dst.cursor() as dcur:
+                folder_ids = {}
+                if _has_table(scur, 'folders'):
+                    scur.execute("SELECT * FROM folders WHERE user_id=%s", (user_id,))
+                    for folder in scur.fetchall():
+                        folder_ids[folder['id']] = _insert_row(dcur, 'folders', folder)
+
+                scur.execute("SELECT * FROM entries WHERE user_id=%s", (user_id,))
+                entries = scur.fetchall()
+                for entry in entries:
+                    if entry.get('folder_id') is not None:
+                        entry['folder_id'] = folder_ids.get(entry['folder_id'])
+                    _insert_row(dcur, 'entries', entry)
+
+                dcur.execute("SELECT COUNT(*) as count FROM entries WHERE user_id=%s", (user_id,))
+                if dcur.fetchone()['count'] != len(entries):
+                    raise RuntimeError(f"Entry count mismatch copying user {user_id}")
+            dst.commit()
+        except BaseException:
+            dst.rollback()
+            raise
+
+        _set_shard(user_id, target, 'active')
+        moved = True
+    finally:
+        if not moved:
+            _set_shard(user_id, source, 'active')
+            if src:
+                src.close()
+        if dst:
+            dst.close()
+
+    try:
+        _delete_user_data(src, source, user_id, drop_user=True)
+    finally:
+        src.close()
+    return target
@@ -0,0 +1,314 @@
+import os
+
+import pytest
+from flask import Flask, session
+
+import session_store
+from session_store import MemorySessionStore, RedisSessionStore, ServerSessionInterface
+
+TTL = 30
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store.time, 'time', clock)
+    return clock
+
+
+def _redis_store():
+    url = os.getenv('TEST_REDIS_URL')
+    if url:
+        store = RedisSessionStore(url)
+        store.redis.flushdb()
+        return store
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    return RedisSessionStore(None, client=fakeredis.FakeRedis(decode_responses=True))
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def store(request):
+    if request.param == 'redis':
+        return _redis_store()
+    return MemorySessionStore()
+
+
+@pytest.fixture
+def redis_store():
+    return _redis_store()
+
+
+class SpyStore:
+    """Wraps a store and records which calls the session interface makes"""
+
+    def __init__(self, store):
+        self.store = store
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        def spy(*args, **kwargs):
+            self.calls.append(name)
+            return method(*args, **kwargs)
+        return spy
+
+
+def _make_app(store):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.session_interface = ServerSessionInterface(store)
+
+    @app.route('/set/<value>')
+    def set_value(value):
+        session['value'] = value
+        session.permanent = True
+        return 'ok'
+
+    @app.route('/get')
+    def get_value():
+        return session.get('value', '')
+
+    @app.route('/login/<user_id>')
+    def login(user_id):
+        session.regenerate()
+        session['_user_id'] = user_id
+        return session.sid
+
+    @app.route('/revoked-mid-request/<user_id>')
+    def revoked_mid_request(user_id):
+        # Another worker revokes the user while this request is running
+        store.delete_user(user_id)
+        session['value'] = 'changed'
+        return 'ok'
+
+    @app.route('/clear')
+    def clear():
+        session.clear()
+        return 'ok'
+
+    return app
+
+
+def _sid(client):
+    cookie = client.get_cookie('session')
+    return cookie.value if cookie else None
+
+
+def test_memory_store_expiry_slides(clock):
+    store = MemorySessionStore()
+    store.save('a', 'data', '1', TTL, new=True)
+    clock.now += TTL - 1
+    store.touch('a', TTL)
+    clock.now += TTL - 1
+    assert store.get('a')['last_seen'] == 1000.0 + TTL - 1
+    clock.now += 2
+    assert store.get('a') is None
+    assert store.sessions_for_user('1') == {}
+
+
+def test_memory_store_cap_evicts_anonymous_sessions_only():
+    store = MemorySessionStore(max_records=10)
+    for i in range(5):
+        store.save(f"user{i}", 'data', str(i), TTL, new=True)
+    for i in range(100):
+        store.save(f"anon{i}", 'data', None, TTL, new=True)
+    assert len(store.records) <= 10
+    assert all(store.get(f"user{i}") for i in range(5))
+    assert store.get('anon99')
+
+
+def test_anonymous_sessions_get_short_ttl(clock):
+    store = MemorySessionStore()
+    app = _make_app(store)
+    client = app.test_client()
+
+    client.get('/set/hello')
+    assert store.records[_sid(client)][1] == clock.now + ServerSessionInterface.ANONYMOUS_TTL
+
+    client.get('/login/7')
+    lifetime = app.permanent_session_lifetime.total_seconds()
+    assert store.records[_sid(client)][1] == clock.now + lifetime
+
+
+def test_redis_touch_slides_session_and_user_index(redis_store):
+    redis_store.save('a', 'data', '1', TTL, new=True)
+    redis_store.redis.expire('session:a', 1)
+    redis_store.redis.expire('user_sessions:1', 1)
+    redis_store.touch('a', TTL)
+    assert redis_store.redis.ttl('session:a') > 1
+    assert redis_store.redis.ttl('user_sessions:1') > 1
+    assert list(redis_store.sessions_for_user('1')) == ['a']
+
+
+def test_redis_touch_does_not_recreate_revoked_session(redis_store):
+    redis_store.save('a', 'data', '1', TTL, new=True)
+    redis_store.delete_user('1')
+    redis_store.touch('a', TTL)
+    assert not redis_store.redis.exists('session:a')
+
+
+def test_redis_hash_without_data_is_missing(redis_store):
+    redis_store.redis.hset('session:a', 'last_seen', 1)
+    assert redis_store.get('a') is None
+
+
+def test_delete_user_only_revokes_that_user(store):
+    store.save('a', 'data', '1', TTL, new=True)
+    store.save('b', 'data', '1', TTL, new=True)
+    store.save('c', 'data', '2', TTL, new=True)
+    assert store.delete_user('1') == 2
+    assert store.get('a') is None and store.get('b') is None
+    assert store.sessions_for_user('1') == {}
+    assert list(store.sessions_for_user('2')) == ['c']
+
+
+def test_session_round_trip_and_touch_only_when_unmodified(store):
+    spy = SpyStore(store)
+    client = _make_app(spy).test_client()
+
+    # Empty anonymous sessions are never stored
+    client.get('/get')
+    assert _sid(client) is None
+    assert spy.calls == []
+
+    client.get('/set/hello')
+    sid = _sid(client)
+    assert sid and store.get(sid)
+
+    spy.calls.clear()
+    for _ in range(3):
+        assert client.get('/get').data == b'hello'
+    assert spy.calls == ['get', 'touch'] * 3
+
+
+def test_regenerate_moves_session_and_drops_old_record(store):
+    client = _make_app(store).test_client()
+    client.get('/set/hello')
+    old_sid = _sid(client)
+
+    new_sid = client.get('/login/7').data.decode()
+
+    assert _sid(client) == new_sid != old_sid
+    assert store.get(old_sid) is None
+    assert client.get('/get').data == b'hello'
+    assert list(store.sessions_for_user('7')) == [new_sid]
+
+
+def test_revoked_session_is_gone(store):
+    client = _make_app(store).test_client()
+    client.get('/set/hello')
+    client.get('/login/7')
+    store.delete_user('7')
+    assert client.get('/get').data == b''
+
+
+def test_save_does_not_recreate_revoked_session(store):
+    store.save('a', 'data', '1', TTL, new=True)
+    store.delete_user('1')
+    assert store.save('a', 'changed', '1', TTL) is False
+    assert store.get('a') is None
+    assert store.sessions_for_user('1') == {}
+
+
+def test_in_flight_request_cannot_revive_revoked_session(store):
+    client = _make_app(store).test_client()
+    client.get('/login/7')
+    sid = _sid(client)
+
+    client.get('/revoked-mid-request/7')
+
+    assert store.get(sid) is None
+    assert store.sessions_for_user('7') == {}
+    assert _sid(client) is None
+
+
+def test_clearing_session_deletes_record_and_cookie(store):
+    client = _make_app(store).test_client()
+    client.get('/set/hello')
+    sid = _sid(client)
+    client.get('/clear')
+    assert store.get(sid) is None
+    assert _sid(client) is None
+
+
+class FakeCursor:
+    def __init__(self, row):
+        self.row = row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, args=None):
+        pass
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+    """Just enough of a pymysql connection for load_user"""
+
+    def __init__(self, row):
+        self.row = row
+        self.opened = 0
+
+    def __call__(self, user_id=None):
+        self.opened += 1
+        return self
+
+    def cursor(self):
+        return FakeCursor(self.row)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def app_client(monkeypatch):
+    import app
+    conn = FakeConnection({'id': 7, 'username': 'alice', 'email': 'a@example.com',
+                           'password_hash': 'x', 'COLUMN_NAME': 'email'})
+    monkeypatch.setattr(app, 'get_db_connection', conn)
+    monkeypatch.setattr(app.app.session_interface, 'store', MemorySessionStore())
+    return app.app.test_client(), conn
+
+
+def test_cached_user_skips_database(app_client):
+    client, conn = app_client
+    with client.session_transaction() as sess:
+        sess['_user_id'] = '7'
+        sess['user'] = {'id': 7, 'username': 'alice', 'email': 'a@example.com'}
+    assert client.get('/generate-password').status_code == 200
+    assert conn.opened == 0
+
+
+def test_database_load_caches_user(app_client):
+    client, conn = app_client
+    with client.session_transaction() as sess:
+        sess['_user_id'] = '7'
+    for _ in range(3):
+        assert client.get('/generate-password').status_code == 200
+    assert conn.opened == 1
+    with client.session_transaction() as sess:
+        assert sess['user'] == {'id': 7, 'username': 'alice', 'email': 'a@example.com'}
+
+
+def test_legacy_remember_cookie_is_ignored_and_cleared(app_client):
+    client, conn = app_client
+    client.set_cookie('remember_token', '7|signature')
+    response = client.get('/generate-password')
+    assert response.status_code == 302
+    assert conn.opened == 0
+    assert client.get_cookie('remember_token') is None
@@ -0,0 +1,432 @@
+"""Sharding tests against real MySQL/MariaDB servers.
+
+Point TEST_MYSQL_SHARDS at two (or more) local instances, e.g.
+
+    TEST_MYSQL_SHARDS=127.0.0.1:3306,127.0.0.1:3307 TEST_MYSQL_USER=root \
+    TEST_MYSQL_PASSWORD=root python -m pytest tests/test_sharding.py
+
+The first instance holds the directory database (itself a shard), the
+second holds shard1. The tests create and drop their own databases. Without
+TEST_MYSQL_SHARDS only the HashRing tests run.
+"""
+import importlib
+import os
+import re
+
+import pymysql
+import pytest
+
+import sharding
+
+DIRECTORY_DB = 'pm_test_directory'
+SHARD1_DB = 'pm_test_shard1'
+PASSWORD = 'Str0ng!pass'
+
+FOLDERS_DDL = """
+    CREATE TABLE folders (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        color VARCHAR(7) DEFAULT '#3B82F6',
+        icon VARCHAR(50) DEFAULT 'folder',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+        UNIQUE KEY unique_folder_name (user_id, name)
+    )
+"""
+FOLDER_ID_DDL = """
+    ALTER TABLE entries
+    ADD COLUMN folder_id INT DEFAULT NULL,
+    ADD CONSTRAINT fk_folder
+    FOREIGN KEY (folder_id) REFERENCES folders(id) ON DELETE SET NULL
+"""
+
+
+def test_hash_ring_is_deterministic():
+    ring = sharding.HashRing(['shard0', 'shard1'])
+    again = sharding.HashRing(['shard1', 'shard0'])
+    assert all(ring.lookup(str(i)) == again.lookup(str(i)) for i in range(1000))
+
+
+def test_hash_ring_spreads_users():
+    ring = sharding.HashRing(['shard0', 'shard1'])
+    on_shard0 = sum(ring.lookup(str(i)) == 'shard0' for i in range(10000))
+    assert 4000 < on_shard0 < 6000
+
+
+def test_hash_ring_adding_a_shard_only_moves_users_to_it():
+    before = sharding.HashRing(['shard0', 'shard1'])
+    after = sharding.HashRing(['shard0', 'shard1', 'shard2'])
+    moved = [i for i in range(10000) if before.lookup(str(i)) != after.lookup(str(i))]
+    assert all(after.lookup(str(i)) == 'shard2' for i in moved)
+    assert len(moved) < 5000
+
+
+def _instances():
+    spec = os.getenv('TEST_MYSQL_SHARDS', '')
+    instances = []
+    for item in spec.split(','):
+        if item.strip():
+            host, _, port = item.strip().partition(':')
+            instances.append((host, int(port or 3306)))
+    return instances
+
+
+def _server_connect(host, port, db=None):
+    return pymysql.connect(
+        host=host,
+        port=port,
+        user=os.getenv('TEST_MYSQL_USER', 'root'),
+        password=os.getenv('TEST_MYSQL_PASSWORD', ''),
+        db=db,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor,
+        autocommit=True
+    )
+
+
+def _create_database(host, port, name):
+    with open(os.path.join(os.path.dirname(__file__), '..', 'schema.sql')) as fh:
+        schema = fh.read()
+    statements = [s.strip() for s in schema.split(';') if s.strip()]
+    statements = [s for s in statements if not re.match(r'(CREATE DATABASE|USE)\b', s)]
+
+    conn = _server_connect(host, port)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {name}")
+            cur.execute(f"CREATE DATABASE {name}")
+            cur.execute(f"USE {name}")
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute(FOLDERS_DDL)
+            cur.execute(FOLDER_ID_DDL)
+    finally:
+        conn.close()
+
+
+def _drop_database(host, port, name):
+    conn = _server_connect(host, port)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {name}")
+    finally:
+        conn.close()
+
+
+def _other_spelling(host):
+    # The same server under another name, to alias the directory
+    return {'127.0.0.1': 'localhost', 'localhost': '127.0.0.1'}.get(host, host)
+
+
+@pytest.fixture(scope='module')
+def cluster():
+    instances = _instances()
+    if len(instances) < 2:
+        pytest.skip('set TEST_MYSQL_SHARDS to two MySQL/MariaDB instances')
+    (host0, port0), (host1, port1) = instances[:2]
+    try:
+        for host, port in instances[:2]:
+            _server_connect(host, port).close()
+    except pymysql.MySQLError as e:
+        pytest.skip(f'MySQL test instances not reachable: {e}')
+
+    _create_database(host0, port0, DIRECTORY_DB)
+    _create_database(host1, port1, SHARD1_DB)
+
+    mp = pytest.MonkeyPatch()
+    mp.setenv('DB_HOST', host0)
+    mp.setenv('DB_PORT', str(port0))
+    mp.setenv('DB_NAME', DIRECTORY_DB)
+    mp.setenv('DB_USER', os.getenv('TEST_MYSQL_USER', 'root'))
+    mp.setenv('DB_PASSWORD', os.getenv('TEST_MYSQL_PASSWORD', ''))
+    mp.setenv('DB_SHARDS', f"shard1={host1}:{port1}/{SHARD1_DB}")
+    mp.setenv('SESSION_STORE', 'memory')
+
+    # Both modules read their configuration at import time
+    importlib.reload(sharding)
+    import app
+    importlib.reload(app)
+    app.app.config['TESTING'] = True
+
+    yield {
+        'app': app,
+        'host0': host0,
+        'port0': port0,
+        'directory': lambda: _server_connect(host0, port0, DIRECTORY_DB),
+        'shard1': lambda: _server_connect(host1, port1, SHARD1_DB),
+    }
+
+    mp.undo()
+    importlib.reload(sharding)
+    importlib.reload(app)
+    _drop_database(host0, port0, DIRECTORY_DB)
+    _drop_database(host1, port1, SHARD1_DB)
+
+
+@pytest.fixture
+def db(cluster):
+    for connect in (cluster['directory'], cluster['shard1']):
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute("SET FOREIGN_KEY_CHECKS=0")
+            for table in ('entries', 'folders', 'user_shards', 'users'):
+                cur.execute(f"TRUNCATE TABLE {table}")
+            cur.execute("SET FOREIGN_KEY_CHECKS=1")
+        conn.close()
+    sharding.shard_cache.clear()
+    return cluster
+
+
+def _query(connect, sql, args=()):
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, args)
+            return list(cur.fetchall())
+    finally:
+        conn.close()
+
+
+def _make_user(db, username, shard_name):
+    """Create a user directly in the directory and place them on a shard"""
+    conn = db['directory']()
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO users (username, email, password_hash) VALUES (%s,%s,'x')",
+                    (username, f"{username}@example.com"))
+        user_id = cur.lastrowid
+        cur.execute("INSERT INTO user_shards (user_id, shard) VALUES (%s,%s)", (user_id, shard_name))
+    conn.close()
+    sharding.mirror_user(sharding.SHARDS_BY_NAME[shard_name], user_id, username,
+                         f"{username}@example.com")
+    return user_id
+
+
+def _add_vault(user_id):
+    """Two folders, an entry in each, and one unorganized entry"""
+    conn = sharding.get_shard_connection(user_id)
+    with conn.cursor() as cur:
+        folder_ids = {}
+        for name in ('Work', 'Personal'):
+            cur.execute("INSERT INTO folders (user_id, name) VALUES (%s,%s)", (user_id, name))
+            folder_ids[name] = cur.lastrowid
+        for title, folder in (('mail', 'Work'), ('bank', 'Personal'), ('misc', None)):
+            cur.execute(
+                "INSERT INTO entries (user_id, title, username, password_encrypted, folder_id) VALUES (%s,%s,'u',%s,%s)",
+                (user_id, title, b'secret', folder_ids.get(folder))
+            )
+    conn.commit()
+    conn.close()
+
+
+def _entries_with_folders(connect, user_id):
+    rows = _query(connect, """
+        SELECT e.title, f.name as folder_name
+        FROM entries e LEFT JOIN folders f ON e.folder_id = f.id
+        WHERE e.user_id=%s ORDER BY e.title
+    """, (user_id,))
+    return [(r['title'], r['folder_name']) for r in rows]
+
+
+def _register(client, username):
+    return client.post('/register', data={
+        'username': username,
+        'email': f"{username}@example.com",
+        'password': PASSWORD,
+        'confirm_password': PASSWORD,
+    })
+
+
+def test_register_places_users_on_both_shards(db):
+    client = db['app'].app.test_client()
+    for i in range(8):
+        assert _register(client, f"user{i}").status_code == 302
+
+    placements = _query(db['directory'], "SELECT user_id, shard FROM user_shards ORDER BY user_id")
+    assert len(placements) == 8
+    for row in placements:
+        assert row['shard'] == sharding.place_user(row['user_id']).name
+    assert {row['shard'] for row in placements} == {'directory', 'shard1'}
+
+    # shard1 users are mirrored there without their password hash
+    on_shard1 = [row['user_id'] for row in placements if row['shard'] == 'shard1']
+    mirrored = _query(db['shard1'], "SELECT id, password_hash FROM users ORDER BY id")
+    assert [row['id'] for row in mirrored] == on_shard1
+    assert all(row['password_hash'] == '' for row in mirrored)
+
+
+def test_mirror_user_surfaces_conflicts(db):
+    user_id = _make_user(db, 'alice', 'shard1')
+    # Same id again is fine, a different id with the same username is not
+    sharding.mirror_user(sharding.SHARDS_BY_NAME['shard1'], user_id, 'alice', 'alice@example.com')
+    with pytest.raises(pymysql.err.IntegrityError):
+        sharding.mirror_user(sharding.SHARDS_BY_NAME['shard1'], user_id + 100, 'alice', 'other@example.com')
+
+
+def test_get_shard_connection_routes_to_assigned_shard(db):
+    in_directory = _make_user(db, 'alice', 'directory')
+    on_shard1 = _make_user(db, 'bob', 'shard1')
+    for user_id, expected in ((in_directory, DIRECTORY_DB), (on_shard1, SHARD1_DB)):
+        conn = sharding.get_shard_connection(user_id)
+        with conn.cursor() as cur:
+            cur.execute("SELECT DATABASE() as db")
+            assert cur.fetchone()['db'] == expected
+        conn.close()
+
+    _add_vault(on_shard1)
+    assert len(_query(db['shard1'], "SELECT id FROM entries WHERE user_id=%s", (on_shard1,))) == 3
+    assert _query(db['directory'], "SELECT id FROM entries WHERE user_id=%s", (on_shard1,)) == []
+
+
+def test_unassigned_user_uses_first_shard(db):
+    conn = db['directory']()
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO users (username, email, password_hash) VALUES ('old','old@example.com','x')")
+        user_id = cur.lastrowid
+    conn.close()
+    assert sharding.shard_for_user(user_id).name == 'directory'
+
+
+def test_shard_lookup_is_cached(db, monkeypatch):
+    user_id = _make_user(db, 'alice', 'shard1')
+    calls = []
+    real = sharding.get_directory_connection
+    monkeypatch.setattr(sharding, 'get_directory_connection', lambda: calls.append(1) or real())
+    for _ in range(3):
+        sharding.get_shard_connection(user_id).close()
+    assert len(calls) == 1
+
+
+def test_migrating_user_gets_503(db):
+    client = db['app'].app.test_client()
+    _register(client, 'alice')
+    client.post('/login', data={'username': 'alice', 'password': PASSWORD})
+    assert client.get('/dashboard').status_code == 200
+
+    user_id = _query(db['directory'], "SELECT id FROM users WHERE username='alice'")[0]['id']
+    _query(db['directory'], "UPDATE user_shards SET status='migrating' WHERE user_id=%s", (user_id,))
+    sharding.shard_cache.clear()
+
+    response = client.get('/dashboard')
+    assert response.status_code == 503
+    assert b'being moved' in response.data
+
+
+def test_move_user_copies_and_remaps_folders(db):
+    user_id = _make_user(db, 'alice', 'directory')
+    _add_vault(user_id)
+    # Someone already on shard1 takes the folder ids alice had in the directory
+    _add_vault(_make_user(db, 'bob', 'shard1'))
+    before = _entries_with_folders(db['directory'], user_id)
+
+    assert sharding.move_user(user_id, 'shard1', drain_seconds=0).name == 'shard1'
+
+    assert _entries_with_folders(db['shard1'], user_id) == before
+    assert _query(db['shard1'], """
+        SELECT e.id FROM entries e JOIN folders f ON e.folder_id = f.id
+        WHERE e.user_id=%s AND f.user_id != e.user_id
+    """, (user_id,)) == []
+    assert len(_query(db['shard1'], "SELECT id FROM folders WHERE user_id=%s", (user_id,))) == 2
+    # Source data is gone, but the account in the directory is kept
+    assert _query(db['directory'], "SELECT id FROM entries WHERE user_id=%s", (user_id,)) == []
+    assert _query(db['directory'], "SELECT id FROM folders WHERE user_id=%s", (user_id,)) == []
+    assert len(_query(db['directory'], "SELECT id FROM users WHERE id=%s", (user_id,))) == 1
+    assert _query(db['directory'], "SELECT shard, status FROM user_shards WHERE user_id=%s",
+                  (user_id,)) == [{'shard': 'shard1', 'status': 'active'}]
+    assert sharding.shard_for_user(user_id).name == 'shard1'
+
+
+def test_move_user_back_drops_mirror_row(db):
+    user_id = _make_user(db, 'alice', 'shard1')
+    _add_vault(user_id)
+    before = _entries_with_folders(db['shard1'], user_id)
+
+    sharding.move_user(user_id, 'directory', drain_seconds=0)
+
+    assert _entries_with_folders(db['directory'], user_id) == before
+    assert _query(db['shard1'], "SELECT id FROM users WHERE id=%s", (user_id,)) == []
+    assert _query(db['shard1'], "SELECT id FROM entries WHERE user_id=%s", (user_id,)) == []
+
+
+def test_move_user_rolls_back_on_count_mismatch(db, monkeypatch):
+    user_id = _make_user(db, 'alice', 'directory')
+    _add_vault(user_id)
+    before = _entries_with_folders(db['directory'], user_id)
+
+    # Drop one entry on the way so the copy check fails
+    real = sharding._insert_row
+    skipped = []
+    def lossy_insert(cur, table, row):
+        if table == 'entries' and not skipped:
+            skipped.append(row)
+            return None
+        return real(cur, table, row)
+    monkeypatch.setattr(sharding, '_insert_row', lossy_insert)
+
+    with pytest.raises(RuntimeError, match='count mismatch'):
+        sharding.move_user(user_id, 'shard1', drain_seconds=0)
+
+    assert _entries_with_folders(db['directory'], user_id) == before
+    assert _query(db['shard1'], "SELECT id FROM entries WHERE user_id=%s", (user_id,)) == []
+    assert _query(db['shard1'], "SELECT id FROM folders WHERE user_id=%s", (user_id,)) == []
+    assert _query(db['directory'], "SELECT shard, status FROM user_shards WHERE user_id=%s",
+                  (user_id,)) == [{'shard': 'directory', 'status': 'active'}]
+
+
+def test_only_one_move_can_claim_a_user(db):
+    user_id = _make_user(db, 'alice', 'directory')
+    source = sharding.SHARDS_BY_NAME['directory']
+    sharding._mark_migrating(user_id, source)
+    with pytest.raises(sharding.ShardMigratingError):
+        sharding._mark_migrating(user_id, source)
+    with pytest.raises(sharding.ShardMigratingError):
+        sharding.move_user(user_id, 'shard1', drain_seconds=0)
+
+
+def test_directory_alias_never_loses_the_account(db, monkeypatch):
+    # The directory listed again under another name and address spelling
+    alias = sharding.Shard('alias', _other_spelling(db['host0']), db['port0'], DIRECTORY_DB)
+    monkeypatch.setitem(sharding.SHARDS_BY_NAME, 'alias', alias)
+    user_id = _make_user(db, 'alice', 'shard1')
+    _add_vault(user_id)
+    before = _entries_with_folders(db['shard1'], user_id)
+
+    with pytest.raises(RuntimeError, match='directory database'):
+        sharding.move_user(user_id, 'alias', drain_seconds=0)
+    assert _entries_with_folders(db['shard1'], user_id) == before
+    assert _query(db['directory'], "SELECT shard, status FROM user_shards WHERE user_id=%s",
+                  (user_id,)) == [{'shard': 'shard1', 'status': 'active'}]
+
+    conn = sharding.connect(alias)
+    sharding._delete_user_data(conn, alias, user_id, drop_user=True)
+    conn.close()
+    assert len(_query(db['directory'], "SELECT id FROM users WHERE id=%s", (user_id,))) == 1
+
+
+def _status(db, user_id):
+    return _query(db['directory'], "SELECT shard, status FROM user_shards WHERE user_id=%s", (user_id,))
+
+
+def test_interrupted_move_leaves_user_active(db, monkeypatch):
+    user_id = _make_user(db, 'alice', 'directory')
+    def interrupt(seconds):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(sharding.time, 'sleep', interrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        sharding.move_user(user_id, 'shard1')
+    assert _status(db, user_id) == [{'shard': 'directory', 'status': 'active'}]
+
+
+def test_unreachable_shard_leaves_user_active(db, monkeypatch):
+    user_id = _make_user(db, 'alice', 'shard1')
+    real = sharding.connect
+    def connect(shard):
+        if shard.name == 'shard1':
+            raise pymysql.err.OperationalError(2003, "Can't connect")
+        return real(shard)
+    monkeypatch.setattr(sharding, 'connect', connect)
+
+    with pytest.raises(pymysql.err.OperationalError):
+        sharding.move_user(user_id, 'directory', drain_seconds=0)
+    assert _status(db, user_id) == [{'shard': 'shard1', 'status': 'active'}]